@@ -14,9 +14,11 @@ External Dependencies:
   xarray
   numpy
   pandas
-  scipy
   matplotlib
   pytides (from https://github.com/groutr/pytides)
+  numba (optional, compiles the --fast-tides projection kernel. Without it
+         --fast-tides runs a pure python loop per sample, which is much
+         slower than the least squares solve it replaces)
 """
 
 import xarray as xr
@@ -26,26 +28,46 @@ import cftime
 import time
 import math
 import json
+import multiprocessing
+import os
+import pickle
 import argparse
+import concurrent.futures
 import datetime
+import functools
+import hashlib
+import itertools
 import pathlib
 from dataclasses import dataclass
 from enum import Enum, auto
-from scipy.stats import pearsonr
 
 try:
     from pytides.tide import Tide
     from pytides.astro import astro
     from pytides.constituent import noaa as noaa_constituents
+    from pytides.constituent import _Z0
     have_pytides = True
 except ImportError:
     have_pytides = False
 
+try:
+    from numba import njit
+except ImportError:
+    # Run the --fast-tides projection kernel as plain python
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+# Simplify and chunk long timeseries lines when rendering
+plt.rcParams['path.simplify_threshold'] = 1.0
+plt.rcParams['agg.path.chunksize'] = 10000
+
 
 # Turn off SettingWithCopyWarning (we are careful not to do that)
 pd.options.mode.chained_assignment = None
@@ -90,6 +112,18 @@ MINHOURS = {
 # Set of constituents to plot
 PLOT_CONSTITUENTS = ['M2', 'S2', 'N2', 'K2', 'O1', 'K1', 'Q1', 'P1']
 
+# Timestamp formats of the known observation date columns
+DATE_FORMATS = {
+    "Date (utc)": "%Y-%m-%d %H:%M:%S%z",  # written by dl_data.py
+    "Date Time": "%Y-%m-%d %H:%M",  # NOAA CO-OPS
+    "Date and Time (GMT)": "%Y/%m/%d %H:%M",
+}
+
+# Lookup of constituents by name. Z0 is added by Tide.decompose.
+if have_pytides:
+    CONSTITUENTS = {c.name: c for c in itertools.chain(noaa_constituents, [_Z0])}
+
+
 class Datum(Enum):
     Unknown = auto()
     MSL = auto()
@@ -111,11 +145,13 @@ class TSData:
     def __init__(self, datum, station_id, data, bias_correct=False):
         self.datum = datum
         self.station_id = station_id
-        self.data = data.copy()
         self.bias_correct = bias_correct
 
         if bias_correct:
-            self.data.observation += (data.model - data.observation).mean()
+            self.data = data.assign(observation=data.observation + (data.model - data.observation).mean())
+        else:
+            # No copy, data is only read from here on (aliases the caller's frame)
+            self.data = data
 
     def __len__(self):
         return len(self.data)
@@ -131,74 +167,136 @@ class TSData:
     def observed(self):
         return self.data.observation
 
+    # Arrays and moments shared by the statistics below
+    @functools.cached_property
+    def _p(self):
+        return self.predicted.to_numpy(dtype=np.float64)
+
+    @functools.cached_property
+    def _o(self):
+        return self.observed.to_numpy(dtype=np.float64)
+
+    @functools.cached_property
+    def _err(self):
+        return self._p - self._o
+
+    @functools.cached_property
+    def _pm(self):
+        return self._p.mean()
+
+    @functools.cached_property
+    def _om(self):
+        return self._o.mean()
+
+    @functools.cached_property
+    def _ps(self):
+        return self._p.std(ddof=1)
+
+    @functools.cached_property
+    def _os(self):
+        return self._o.std(ddof=1)
+
     def bias(self):
-        return (self.predicted - self.observed).mean()
+        return self._pm - self._om
 
     def rmse(self):
-        return math.sqrt(np.square(self.predicted - self.observed).mean())
+        d = self._err
+        return math.sqrt(np.dot(d, d)/d.size)
 
     def skill(self):
-        n = (np.square(self.predicted - self.observed)).sum()
-        om = self.observed.mean()
-        d = (self.predicted - om).abs() + (self.observed - om).abs()
-        d = np.square(d).sum()
-        return 1 - n/d
+        d = self._err
+        n = np.dot(d, d)
+        t = np.abs(self._p - self._om) + np.abs(self._o - self._om)
+        return 1 - n/np.dot(t, t)
     
     def r(self):
-        r1 = (self.predicted - self.predicted.mean())/self.predicted.std()
-        r2 = (self.observed - self.observed.mean())/self.observed.std()
-        return 1/(len(self)-1) * np.sum(r1 * r2)
+        r1 = (self._p - self._pm)/self._ps
+        r2 = (self._o - self._om)/self._os
+        return 1/(len(self)-1) * np.dot(r1, r2)
 
     def corr(self):
-        return pearsonr(self.predicted, self.observed)
+        return _corr(self._p, self._o)
 
     def range(self):
         return self.data.max() - self.data.min()
 
     def nrmse(self):
-        return 100 * self.rmse()/self.range().observation
+        return 100 * self.rmse()/(self._o.max() - self._o.min())
 
 
-def mae_phase(model, obs):
-    tmp = np.abs(phase_correct(obs - model))
-    return np.sum(tmp)/len(tmp)
+def _corr(x, y):
+    """Pearson correlation coefficient of x and y"""
+    x = x - x.mean()
+    y = y - y.mean()
+    return float(x @ y / math.sqrt((x @ x) * (y @ y)))
 
 
-def mre(model, obs):
-    tmp = np.abs(obs - model)/obs
-    return np.sum(tmp)/len(tmp)
+def phase_correct(pdiff):
+    """Wrap phase difference so all readings are in [-180, 180)"""
+    pdiff = np.asarray(pdiff, dtype=np.float64)
+    return np.mod(pdiff + 180.0, 360.0) - 180.0
 
 
-def mean_rmse(Am, An, Pm, Pn):
-    tmp = 0.5 * (Am ** 2 + An ** 2) - Am * An * np.cos(np.pi*phase_correct(Pm - Pn)/180)
-    return np.sum(np.sqrt(tmp))/len(tmp)
+@functools.lru_cache(maxsize=256)
+def _astro(epoch):
+    return astro(epoch)
 
 
-def rmse(model, obs):
-    return math.sqrt(np.square(model - obs).mean())
+@functools.lru_cache(maxsize=4096)
+def _speed(name, epoch):
+    """Speed of constituent at epoch (rounded to the hour)"""
+    return CONSTITUENTS[name].speed(_astro(epoch))
 
 
-def phase_correct(pdiff):
-    """Correct phase difference so all readings are in [0, 360]"""
-    pdiff[pdiff > 180] = 360 - pdiff[pdiff > 180]
-    pdiff[pdiff < -180] = 360 + pdiff[pdiff < -180]
-    return pdiff
+@njit(cache=True, fastmath=True)
+def _project(heights, hours, speed):
+    """Complex amplitude of heights at speed (deg/hr)"""
+    w = math.pi * speed / 180
+    re = 0.0
+    im = 0.0
+    for i in range(heights.size):
+        re += heights[i] * math.cos(w * hours[i])
+        im -= heights[i] * math.sin(w * hours[i])
+    return 2 * re / heights.size, 2 * im / heights.size
 
 
-def tidal_analysis(d):
-    """Solve for tidal constituents.
+def fast_decompose(heights, hours, a0, constituents):
+    """Estimate constituents without a least squares fit.
+
+    Each constituent is estimated by projecting the demeaned series onto
+    its frequency (a single DFT bin, as in the Goertzel algorithm). This
+    ignores leakage between constituents, so it is only a reasonable
+    estimate when constituents are resolvable (see MINHOURS).
 
     Args:
-        d (TSData): [description]
+        heights (ndarray): Water levels
+        hours (ndarray): Hours since start of series
+        a0 (dict): Astronomical arguments at start of series
+        constituents (list): Constituents to estimate
 
     Returns:
-        tuple: (DataFrame, DataFrame)
+        list: dicts of constituent, amplitude and phase (like Tide.model)
+    """
+    heights = np.asarray(heights, dtype=np.float64)
+    hours = np.asarray(hours, dtype=np.float64)
+    mean = heights.mean()
+    resid = heights - mean
+
+    rv = [{'constituent': _Z0, 'amplitude': mean, 'phase': 0.0}]
+    for c in constituents:
+        re, im = _project(resid, hours, c.speed(a0))
+        # h(t) = A*f*cos(speed*t + V0 + u - phase)
+        amplitude = math.hypot(re, im) / c.f(a0)
+        phase = (c.V(a0) + c.u(a0) - math.degrees(math.atan2(im, re))) % 360
+        rv.append({'constituent': c, 'amplitude': amplitude, 'phase': phase})
+    return rv
+
+
+def select_constituents(thrs):
+    """Filter list of constituents by MINHOURS
+
+    Only solve for constituents for which we have enough data.
     """
-    # Filter list of constituents by MIN_HOURS
-    # to only solve for constituents for which we have enough data.
-    newdata = d.data
-    t = newdata.index.to_pydatetime()
-    thrs = (t[-1] - t[0]).total_seconds() / 3600
     _constituents = []
     for c in noaa_constituents:
         minh = MINHOURS.get(str(c))
@@ -208,35 +306,119 @@ def tidal_analysis(d):
         elif minh is None and thrs >= 24*366:
             # If we have 1 year of data, add constituent
             _constituents.append(c)
+    return _constituents
+
+
+def _hours(index):
+    """Hours since the first timestamp of a DatetimeIndex (any resolution)"""
+    return np.asarray((index - index[0]) / pd.Timedelta(hours=1), dtype=np.float64)
+
+
+def tidal_analysis(d, fast=False):
+    """Solve for tidal constituents.
+
+    Args:
+        d (TSData): [description]
+        fast (bool): Estimate constituents with fast_decompose instead of Tide.decompose
+
+    Returns:
+        tuple: (DataFrame, DataFrame)
+    """
+    newdata = d.data
+    # Hours since start of series. Model and observations share the
+    # joined index, so the same hours are used for both solves.
+    t0 = newdata.index[0].to_pydatetime()
+    hours = _hours(newdata.index)
+    _constituents = select_constituents(hours[-1])
     _cstrs = list(map(str, _constituents))
+    # Round epoch to reduce the number of astro evaluations
+    epoch = t0.replace(minute=0, second=0, microsecond=0)
+
+    if fast:
+        a0 = astro(t0)
+
+    def decompose(heights):
+        if fast:
+            return fast_decompose(heights, hours, a0, _constituents)
+        return Tide.decompose(heights, hours, t0=t0, constituents=_constituents).model
 
     # Solve for predicted (model) constituents
     start = time.perf_counter()
-    tide = Tide.decompose(d.predicted.values, t, constituents=_constituents)
+    tide = decompose(d.predicted.values)
     print(d.station_id, "Model solve: ", time.perf_counter() - start, "for", _cstrs)
     data = ((x['constituent'].name, 
-            x['constituent'].speed(astro(t[0])), 
+            _speed(x['constituent'].name, epoch), 
             x['amplitude'], 
-            x['phase']) for x in tide.model)
+            x['phase']) for x in tide)
     model_rv = pd.DataFrame(list(data), columns=['constituent', 'speed', 'amplitude', 'phase'])
     model_rv = model_rv.set_index('constituent')
 
     # Solve for constituents in observed values
     water_lev = d.observed
-    t = water_lev.index.to_pydatetime()
     start = time.perf_counter()
-    tide = Tide.decompose(water_lev.values, t, constituents=_constituents)
+    tide = decompose(water_lev.values)
     print(d.station_id, "observed solve: ", time.perf_counter() - start, "for", _cstrs)
 
     data = ((x['constituent'].name, 
-            x['constituent'].speed(astro(t[0])),
+            _speed(x['constituent'].name, epoch),
             x['amplitude'], 
-            x['phase']) for x in tide.model)
+            x['phase']) for x in tide)
     
     obs_rv = pd.DataFrame(list(data), columns=['constituent', 'speed', 'amplitude', 'phase'])
     obs_rv = obs_rv.set_index('constituent')
     return model_rv, obs_rv
 
+
+def cached_tidal_analysis(d, cache_dir, fast=False):
+    """Memoize tidal_analysis to disk.
+
+    Results are keyed on a hash of the station data and the constituents
+    solved for, so unchanged stations are not solved again on re-runs.
+    """
+    _cstrs = map(str, select_constituents(_hours(d.data.index)[-1]))
+    key = hashlib.blake2b(digest_size=16)
+    key.update(_as_ns(d.data.index).tobytes())
+    key.update(d.predicted.to_numpy(dtype=np.float64).tobytes())
+    key.update(d.observed.to_numpy(dtype=np.float64).tobytes())
+    key.update(','.join(sorted(_cstrs)).encode())
+    key.update(b'fast' if fast else b'lstsq')
+    path = cache_dir/f"{d.station_id}_{key.hexdigest()}.pkl"
+
+    if path.is_file():
+        print(d.station_id, "using cached tidal solve", path.name)
+        with open(path, 'rb') as fh:
+            return pickle.load(fh)
+
+    rv = tidal_analysis(d, fast=fast)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Write then rename so concurrent workers never read a partial file
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, 'wb') as fh:
+        pickle.dump(rv, fh)
+    os.replace(tmp, path)
+    return rv
+
+
+def reuse_figure(num, ncols=1, figsize=None):
+    """Get a figure that is reused for every station in this process.
+
+    The figure is created on first use. Afterwards its axes are cleared
+    instead of building a new figure.
+
+    Returns:
+        tuple: (Figure, list of Axes)
+    """
+    if plt.fignum_exists(num):
+        fig = plt.figure(num)
+        axs = fig.axes
+        for ax in axs:
+            ax.cla()
+    else:
+        fig, axs = plt.subplots(1, ncols, figsize=figsize, num=num)
+        axs = list(np.atleast_1d(axs))
+    return fig, axs
+
+
 def tide_plots(model_tide, obs_tide, out_path, station_id):
     # Write tidal constitent csv reports
     model_tide.to_csv(out_path/f"{station_id}_model.csv")
@@ -250,7 +432,7 @@ def tide_plots(model_tide, obs_tide, out_path, station_id):
     
     mt['phase_hr'] = mt['phase']/mt['speed']
     ot['phase_hr'] = ot['phase']/ot['speed']
-    fig, axs = plt.subplots(1, 3, figsize=(20, 10))
+    fig, axs = reuse_figure("tidal", ncols=3, figsize=(20, 10))
     fig.tight_layout()
     fig.suptitle(f"NOAA Station {station_id}", size=20, fontweight="bold")
     
@@ -295,8 +477,7 @@ def tide_plots(model_tide, obs_tide, out_path, station_id):
     ax.scatter(o.values, m.values)
     for x, y, label in zip(o, m, m.index):
         ax.text(x, y, label, size=15)
-    plt.savefig(out_path/f"{station_id}_tidal.png", dpi=200, bbox_inches="tight")
-    plt.close(fig)
+    fig.savefig(out_path/f"{station_id}_tidal.png", dpi=150, bbox_inches="tight")
 
 
 def tidal_error(model, obs, out_path):
@@ -315,21 +496,16 @@ def tidal_error(model, obs, out_path):
     M.to_csv(out_path/"Model_solved_tidal.csv")
     O.to_csv(out_path/"NOAA_solved_tidal.csv")
 
+    # Pair model and observed constituents per station
+    merged = model.merge(obs, on=['station', 'constituent'], suffixes=('_m', '_o'))
+    Am, An = merged.amplitude_m, merged.amplitude_o
+    merged['phase_err'] = np.abs(phase_correct(merged.phase_o - merged.phase_m))
+    merged['amp_rel'] = (An - Am).abs()/An
+    merged['rmse_term'] = np.sqrt(0.5 * (Am ** 2 + An ** 2) - Am * An * np.cos(np.deg2rad(merged.phase_err)))
 
-    _const = M.columns.get_level_values('constituent').unique()
-    stats = pd.DataFrame(index=_const, columns=['MAE', 'MRE', 'MRMSE'])
-
-    for c in _const:
-        stats.loc[c, "MAE"] = mae_phase(M[("phase", c)], O[("phase", c)])
-
-    for c in _const:
-        stats.loc[c, "MRE"] = mre(M[("amplitude", c)], O[("amplitude", c)])
-
-    for c in _const:
-        x = ("amplitude", c)
-        y = ("phase", c)
-        stats.loc[c, "MRMSE"] = mean_rmse(M[x], O[x], M[y], O[y])
-
+    stats = merged.groupby('constituent').agg(MAE=('phase_err', 'mean'),
+                                              MRE=('amp_rel', 'mean'),
+                                              MRMSE=('rmse_term', 'mean'))
     stats.to_csv(out_path/"Mean_stats.csv")
 
 
@@ -340,7 +516,37 @@ def amplitude_plot(model, obs, out_path):
                 'marker': 'o', 
                 'markersize': 5,
                 'linestyle': ''}
+    corr_opts = {'xy': (0.8, 0.03),
+                'xycoords': 'axes fraction',
+                'fontsize': 8,
+                'bbox': dict(boxstyle="square", fc="white", ec="white")}
     fig, axs = plt.subplots(1, 2, figsize=(12, 6))
+    title = fig.suptitle("", size=20, fontweight='bold')
+
+    # Build the axes once and only update the artists that change per constituent
+    ax = axs[0]
+    ax.set_xlabel("Amplitude (m) - NOAA", size=12)
+    ax.set_ylabel("Amplitude (m) - Model", size=12)
+    # (x, y) scale of each reference line end point
+    amp_scales = ((1, 1), (1, 0.95), (1, 0.9), (0.95, 1), (0.9, 1))
+    amp_refs = [ax.plot([], [], fmt, **ref_lines)[0] for fmt in ('k', 'k--', 'k:', 'k--', 'k:')]
+    amp_data, = ax.plot([], [], **data_opts)
+    amp_corr = ax.annotate("", **corr_opts)
+
+    ax = axs[1]
+    axlim = 400
+    ax.set_xlim([0, axlim])
+    ax.set_ylim([0, axlim])
+    ax.set_xlabel("Phase (deg) - NOAA", size=12)
+    ax.set_ylabel("Phase (deg) - Model", size=12)
+    ax.plot([0,axlim],[0,axlim],'k', **ref_lines)
+    ax.plot([10,axlim],[0,axlim-10],'k--', **ref_lines)
+    ax.plot([20,axlim],[0,axlim-20],'k:', **ref_lines)
+    ax.plot([0,axlim-10],[10,axlim],'k--', **ref_lines)
+    ax.plot([0,axlim-20],[20,axlim],'k:', **ref_lines)
+    phase_data, = ax.plot([], [], **data_opts)
+    phase_corr = ax.annotate("", **corr_opts)
+
     for c in PLOT_CONSTITUENTS:
         M = model[model.constituent == c]
         O = obs[obs.constituent == c]
@@ -349,46 +555,29 @@ def amplitude_plot(model, obs, out_path):
         
         print("Plotting", c, "phase amplitude")
         
-        fig.suptitle(f"{c} constituent", size=20, fontweight='bold')
+        title.set_text(f"{c} constituent")
 
         ax = axs[0]
-        maxav = 1.2 * max(M.amplitude.max(), O.amplitude.max())
+        ma = M.amplitude.to_numpy()
+        oa = O.amplitude.to_numpy()
+        maxav = 1.2 * max(ma.max(), oa.max())
         axlim = max(round(maxav, 1), 0.05)
         ax.set_xlim([0, axlim])
         ax.set_ylim([0, axlim])
-        ax.set_xlabel("Amplitude (m) - NOAA", size=12)
-        ax.set_ylabel("Amplitude (m) - Model", size=12)
-        ax.plot([0, axlim], [0, axlim], 'k', **ref_lines)
-        ax.plot([0, axlim], [0, 0.95*axlim], 'k--', **ref_lines)
-        ax.plot([0, axlim], [0, 0.9*axlim], 'k:', **ref_lines)
-        ax.plot([0, 0.95*axlim], [0, axlim], 'k--', **ref_lines)
-        ax.plot([0, 0.9*axlim], [0, axlim], 'k:', **ref_lines)
-        ax.plot(O.amplitude, M.amplitude, **data_opts)
-        tmp = pearsonr(M.amplitude, O.amplitude)[0]
-        ax.annotate(f"Corr: {round(tmp, 3)}", xy=(0.8, 0.03), xycoords='axes fraction', fontsize=8, bbox=dict(boxstyle="square", fc="white", ec="white"))
-
-
-        ax = axs[1]
-        diff = M.phase - O.phase
-        M.loc[diff < -180, "phase"] = M.loc[diff < -180, "phase"] + 360
-        O.loc[diff > 180, "phase"]  = O.loc[diff > 180, "phase"] + 360
-        axlim = 400
-        ax.set_xlim([0, axlim])
-        ax.set_ylim([0, axlim])
-        ax.set_xlabel("Phase (deg) - NOAA", size=12)
-        ax.set_ylabel("Phase (deg) - Model", size=12)
-        ax.plot([0,axlim],[0,axlim],'k', **ref_lines)
-        ax.plot([10,axlim],[0,axlim-10],'k--', **ref_lines)
-        ax.plot([20,axlim],[0,axlim-20],'k:', **ref_lines)
-        ax.plot([0,axlim-10],[10,axlim],'k--', **ref_lines)
-        ax.plot([0,axlim-20],[20,axlim],'k:', **ref_lines)
-        ax.plot(O.phase, M.phase, **data_opts)
-        tmp = pearsonr(M.phase, O.phase)[0]
-        ax.annotate(f"Corr: {round(tmp, 3)}", xy=(0.8, 0.03), xycoords='axes fraction', fontsize=8, bbox=dict(boxstyle="square", fc="white", ec="white"))
-
-        plt.savefig(out_path/f"{c}_AP_Comparison.png", dpi=600, bbox_inches='tight')
-        axs[0].cla()
-        axs[1].cla()
+        for line, (sx, sy) in zip(amp_refs, amp_scales):
+            line.set_data([0, sx*axlim], [0, sy*axlim])
+        amp_data.set_data(oa, ma)
+        amp_corr.set_text(f"Corr: {round(_corr(ma, oa), 3)}")
+
+        mp = M.phase.to_numpy()
+        op = O.phase.to_numpy()
+        diff = mp - op
+        mp = np.where(diff < -180, mp + 360, mp)
+        op = np.where(diff > 180, op + 360, op)
+        phase_data.set_data(op, mp)
+        phase_corr.set_text(f"Corr: {round(_corr(mp, op), 3)}")
+
+        fig.savefig(out_path/f"{c}_AP_Comparison.png", dpi=150, bbox_inches='tight')
     plt.close(fig)
 
 
@@ -406,7 +595,7 @@ def open_nc(filename):
         
 
 def open_csv(filename):
-    possible_dates = ["Date (utc)", "Date Time", "Date and Time (GMT)"]
+    possible_dates = list(DATE_FORMATS)
     possible_data = ["gage height (m)", "Water Level", 
                     "Water level (m NAVD88)", 
                     "Elevation ocean/est (m NAVD88)", 
@@ -431,21 +620,34 @@ def open_csv(filename):
     else:
         rname = 'prediction'
     df = obs_ds.loc[:, [date_label, value_label]].rename(columns={date_label: "date", value_label: rname})
-    df["date"] = pd.to_datetime(df["date"])
+    dates = pd.to_datetime(df["date"], format=DATE_FORMATS[date_label], cache=True, errors='coerce')
+    if (dates.isna() & df["date"].notna()).any():
+        # Unexpected format, let pandas infer it
+        dates = pd.to_datetime(df["date"], cache=True)
+    df["date"] = dates
     df = df.loc[pd.notna(df["date"])]
-    df = df.set_index("date").sort_index().tz_localize(None)
+    df = df.set_index("date")
+    # Data files are usually chronological already
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    df = df.tz_localize(None)
 
     return df
 
 
+def _as_ns(index):
+    """Integer nanoseconds of a DatetimeIndex, whatever its resolution"""
+    return index.values.astype('datetime64[ns]').view(np.int64)
+
+
 def higher_resolution(df1, df2):
     """Return the argument with the higher resolution"""
-    def mode(data):
-        values, counts = np.unique(np.diff(data), return_counts=True)
-        return values[counts.argmax()]
+    def step(data):
+        # Typical sampling interval (ns) of the index
+        return np.median(np.diff(_as_ns(data)))
 
     # Higher resolution timeseries has smaller diff
-    if mode(df1.index) < mode(df2.index):
+    if step(df1.index) < step(df2.index):
         return df1
     else:
         return df2
@@ -459,7 +661,7 @@ def maxlim(model, obs):
 
 
 def open_his_waterlevel(fn):
-    with xr.open_mfdataset(fn) as ds:
+    with xr.open_mfdataset(fn, parallel=True, combine='by_coords', chunks={'time': 8760}) as ds:
         ds['station_name'] = ds.station_name.compute().str.strip()
         waterlevel = ds.waterlevel
         waterlevel = waterlevel.set_index(stations='station_name').sortby('stations')
@@ -474,29 +676,51 @@ def open_schism_elevation(fn):
         rv = cftime.num2date(times.values, f"seconds since {base_date.isoformat()}")
         return rv.astype('datetime64[ns]')
 
-    with xr.open_mfdataset(fn) as ds:
+    # Keep whole timeseries in a chunk so node selection reads contiguous blocks
+    with xr.open_mfdataset(fn, parallel=True, combine='by_coords',
+                           chunks={'time': -1, 'nSCHISM_hgrid_node': 'auto'}) as ds:
         elevation = ds.elevation
         if elevation['time'].dtype.kind != "M":
             elevation["time"] = convert_schism_time(elevation["time"])
         return elevation
 
-def select_schism_nodes(data, indexer):
+def load_schism_nodes(data, indexers):
+    """Load elevation of every node referenced by indexers into memory.
+
+    Returns:
+        tuple: (time index, array of shape (time, node), mapping of node to column)
+    """
+    # Indexers are JSON lists of nodes
+    nodes = sorted(set(itertools.chain.from_iterable(map(json.loads, indexers.dropna()))))
+    values = data[:, nodes].values
+    return data.indexes['time'], values, {n: i for i, n in enumerate(nodes)}
+
+
+def select_schism_nodes(times, values, columns, indexer):
     # Indexer will be a string
     indexer = json.loads(indexer)
-    _elevation = data[:, indexer]
-    _elevation = _elevation.mean(axis=1)
-
-    model = _elevation.squeeze().to_dataframe().rename(columns={'elevation': 'model'})
+    _elevation = pd.DataFrame(values[:, [columns[n] for n in indexer]], index=times)
+    model = _elevation.mean(axis=1).to_frame('model')
     return model
 
-def select_dflow_sites(data, indexer):
+
+def load_dflow_sites(data):
+    """Load waterlevel of every station into memory.
+
+    Returns:
+        tuple: (time index, array of shape (time, station), mapping of station to column)
+    """
     index = data.stations.str.strip().values
-    waterlevel = data[:, index == indexer]
+    values = data.values
+    return data.indexes['time'], values, {name: i for i, name in enumerate(index)}
 
-    model = waterlevel.drop_vars(['station_x_coordinate', 'station_y_coordinate', 'stations'])
-    model = model.squeeze().to_dataframe().rename(columns={"waterlevel": "model"})
+
+def select_dflow_sites(times, values, columns, indexer):
+    if indexer not in columns:
+        return None
+    model = pd.DataFrame({'model': values[:, columns[indexer]]}, index=times)
     return model
-    
+
 
 def read_correspondence_table(path, storms):
     # Correspondence table has the following columns
@@ -524,10 +748,112 @@ def read_correspondence_table(path, storms):
     return correspond
 
 
-def main(args):
+def process_station(station, metadata, model, path, mlabel, args):
+    """Compare model and observations for a single station.
+
+    Writes the joined timeseries, waterlevel plot and (optionally)
+    tidal constituent reports for the station.
+
+    Returns:
+        tuple: (summary row, list of tidal records) or None if station is skipped
+    """
     cutter = datetime.timedelta(hours=args.cut)
+    T = model.index[model.index >= model.index[0]+cutter]
+    # drop first twelve hours of model to remove warmup effects
+    model = model.loc[T]
+    model.index = model.index.tz_localize(None)
+    modelfreq = model.index[1] - model.index[0]
+
+    # Get the observation data
+    obs = open_csv(path)
+    obs_label = obs.columns[0]
+    obs = obs.rename(columns={obs_label: 'observation'})
+
+    # Restrict observation range to model range
+    obs = obs.loc[model.index[0]:model.index[-1]+modelfreq]
+    
+    # At times obs is malformed csv, so we check if len == 1.
+    if obs.empty or len(obs) == 1 or model.empty:
+        return
+    obsfreq = obs.index[1] - obs.index[0]
+    
+    # Align model and observations on a common time grid
+    if higher_resolution(obs, model) is obs:
+        # Downsample observations to match model, but do not interpolate
+        target = model.index
+        model_values = model.model.to_numpy()
+    else:
+        # Interpolate model onto the (regular) observation grid.
+        # Interpolate across missing model values instead of propagating NaN.
+        valid = model.model.notna().to_numpy()
+        if not valid.any():
+            print("Joined dataframe is empty for station", station)
+            return
+        times = _as_ns(model.index)[valid]
+        target = pd.date_range(obs.index[0], obs.index[-1], freq=obsfreq, name=model.index.name)
+        target_ns = _as_ns(target)
+        in_span = (target_ns >= times[0]) & (target_ns <= times[-1])
+        target = target[in_span]
+        model_values = np.interp(target_ns[in_span], times, model.model.to_numpy()[valid])
+
+    if not obs.index.is_unique:
+        obs = obs.loc[~obs.index.duplicated()]
+    obs_values = obs.observation.reindex(target).to_numpy()
+
+    # Drop leading/trailing nans from obs
+    joined = pd.DataFrame({'model': model_values, 'observation': obs_values}, index=target).dropna()
+    if joined.empty:
+        print("Joined dataframe is empty for station", station)
+        return
+    
+    d = TSData(metadata['Datum'], station, joined, bias_correct=args.bias_correct)
+
+    print("writing and plotting", d.station_id)
+    d.data.to_csv(args.output/f'{d.station_id}.csv')
+    fig, (ax,) = reuse_figure("waterlevel", figsize=(10, 5))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
+
+    ax.plot(d.observed, 'r', marker=',', linestyle='-', label=obs_label.capitalize(), linewidth=2, rasterized=True)
+    ax.plot(d.predicted, 'b', marker=',', linestyle='-', label=mlabel, linewidth=2, rasterized=True)
+    ax.legend()
+    ax.grid(True)
+    ax.set_title(f"Station ID: {d.station_id}", size=20, fontweight='bold', color='k')
+
+    if d.datum:
+        ax.set_ylabel(f"Water level (m {d.datum})", size=15)
+    else:
+        ax.set_ylabel("Water level (m)", size=15)
+
+    ax.set_xlabel(f"Date [{d.data.index[0].year}]", size=15)
+
+    measures = (d.bias(), d.corr(), d.rmse(), d.nrmse(), d.skill())
+    # add timeseries statistics
+    rounded = tuple(round(x, 3) for x in measures)
+    stat_str = f"Bias: {rounded[0]}\nCorr: {rounded[1]}\nRMSE: {rounded[2]}\nNRMSE: {rounded[3]}\nSkill: {rounded[4]}"
+    ax.annotate(stat_str, xy=(0.825, 0.06), 
+            fontsize=8,
+            xycoords="axes fraction",
+            bbox={'boxstyle': 'square', 'facecolor': 'white', 'alpha': 0.75})
+    fig.savefig(args.output/f"{d.station_id}.png", bbox_inches='tight', dpi=150)
+
+    if args.tide:
+        if args.no_cache:
+            mt, ot = tidal_analysis(d, fast=args.fast_tides)
+        else:
+            mt, ot = cached_tidal_analysis(d, args.output/".tidecache", fast=args.fast_tides)
+        tide_plots(mt, ot, args.output, d.station_id)
+        # Flat (station, constituent, speed, amplitude, phase, kind) records
+        tides = [(d.station_id,) + row + (kind,)
+                 for kind, t in (('model', mt), ('obs', ot))
+                 for row in t.itertuples(name=None)]
+    else:
+        tides = []
+    return (d.station_id,) + measures, tides
+
+
+def main(args):
     summary = []
-    tidal_summary = []
+    tidal_rows = []
 
     correspond = read_correspondence_table(args.correspond, args.storm)
 
@@ -535,120 +861,65 @@ def main(args):
 
     if args.model_type == "schism":
         waterlevels = open_schism_elevation(args.model)
+        model_data = load_schism_nodes(waterlevels, correspond['Nodes'])
         mlabel = "SCHISM"
     elif args.model_type == "dflow":
         waterlevels = open_his_waterlevel(args.model)
+        model_data = load_dflow_sites(waterlevels)
         mlabel = "DFlow"
     
-    for station in correspond.index:
-        metadata = correspond.loc[station]
-        fn = metadata["ProcessedCSVLoc"]
-        if not fn.name:
-            continue
-        path = args.obs / fn
-        if not path.is_file():
-            print("Skipping", path, "(data file not found)")
-            continue
-
-        # Select station from waterlevel file
-        if args.model_type == "schism":
-            nodes = metadata['Nodes']
-            model = select_schism_nodes(waterlevels, nodes)
-        else:
-            model = select_dflow_sites(waterlevels, station.encode())
-
-        if np.isnan(model.values).all():
-            continue
-        
-        T = model.index[model.index >= model.index[0]+cutter]
-        # drop first twelve hours of model to remove warmup effects
-        model = model.loc[T]
-        model.index = model.index.tz_localize(None)
-        modelfreq = model.index[1] - model.index[0]
-
-        # Get the observation data
-        obs = open_csv(path)
-        obs_label = obs.columns[0]
-        obs = obs.rename(columns={obs_label: 'observation'})
-
-        # Restrict observation range to model range
-        obs = obs.loc[model.index[0]:model.index[-1]+modelfreq]
-        
-        # At times obs is malformed csv, so we check if len == 1.
-        if obs.empty or len(obs) == 1 or model.empty:
-            continue
-        obsfreq = obs.index[1] - obs.index[0]
-        
-        # Resample model to frequency of obs
-        if higher_resolution(obs, model) is obs:
-            # Downsample observations to match model, but do not interpolate
-            obs_data = obs.resample(modelfreq, origin=model.index[0]).asfreq()
-            model_data = model
-        else:
-            # Resample and interpolate model
-            model_data = model.resample(obsfreq, origin=obs.index[0]).interpolate(method='linear')
-            obs_data = obs.asfreq(obsfreq)  # Ensure that obs is regular
-
-        # Drop leading/trailing nans from obs
-        joined = model_data.join(obs_data, how='inner').sort_index().dropna()
-        if joined.empty:
-            print("Joined dataframe is empty for station", station)
-            continue                
-        
-        d = TSData(metadata['Datum'], station, joined, bias_correct=args.bias_correct)
-
-        print("writing and plotting", d.station_id)
-        d.data.to_csv(args.output/f'{d.station_id}.csv')
-        fig = plt.figure(figsize=(10, 5))
-        ax = plt.gca()
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
-
-        ax.plot(d.observed, 'r', marker=',', linestyle='-', label=obs_label.capitalize(), linewidth=2)
-        ax.plot(d.predicted, 'b', marker=',', linestyle='-', label=mlabel, linewidth=2)
-        ax.legend()
-        ax.grid()
-        ax.set_title(f"Station ID: {d.station_id}", size=20, fontweight='bold', color='k')
-
-        if d.datum:
-            ax.set_ylabel(f"Water level (m {d.datum})", size=15)
-        else:
-            ax.set_ylabel("Water level (m)", size=15)
-
-        ax.set_xlabel(f"Date [{d.data.index[0].year}]", size=15)
-
-        measures = (d.bias(), d.corr()[0], d.rmse(), d.nrmse(), d.skill())
-        # add timeseries statistics
-        summary.append((d.station_id,) + measures)
-        measures = tuple(round(x, 3) for x in measures)
-        stat_str = f"Bias: {measures[0]}\nCorr: {measures[1]}\nRMSE: {measures[2]}\nNRMSE: {measures[3]}\nSkill: {measures[4]}"
-        ax.annotate(stat_str, xy=(0.825, 0.06), 
-                fontsize=8,
-                xycoords="axes fraction",
-                bbox={'boxstyle': 'square', 'facecolor': 'white', 'alpha': 0.75})
-        plt.savefig(args.output/f"{d.station_id}.png", bbox_inches='tight', dpi=300)
-        plt.close(fig)
-
-        if args.tide:
-            mt, ot = tidal_analysis(d)
-            tide_plots(mt, ot, args.output, d.station_id)
-            mt["station"] = d.station_id
-            ot["station"] = d.station_id
-            tidal_summary.append((mt, ot))
+    jobs = []
+    # Spawn workers: forking after dask's threaded loads can deadlock
+    ctx = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, mp_context=ctx) as executor:
+        for station in correspond.index:
+            metadata = correspond.loc[station]
+            fn = metadata["ProcessedCSVLoc"]
+            if not fn.name:
+                continue
+            path = args.obs / fn
+            if not path.is_file():
+                print("Skipping", path, "(data file not found)")
+                continue
+
+            # Select station from waterlevel file
+            if args.model_type == "schism":
+                nodes = metadata['Nodes']
+                model = select_schism_nodes(*model_data, nodes)
+            else:
+                model = select_dflow_sites(*model_data, station.encode())
+
+            if model is None or not np.isfinite(model.model.to_numpy()).any():
+                continue
+
+            jobs.append((station, executor.submit(process_station, station, metadata, model, path, mlabel, args)))
+
+        # Collect in submission order so output follows the correspondence table
+        for station, job in jobs:
+            if exc := job.exception():
+                print("Skipping station", station, f"(failed with {exc!r})")
+                continue
+            rv = job.result()
+            if rv is None:
+                continue
+            measures, tides = rv
+            summary.append(measures)
+            tidal_rows.extend(tides)
 
     # Close waterlevel datasets
     for wl in waterlevels:
         wl.close()
 
-    #Filter summary and tidal_summary (if necessary) by skill
+    #Filter summary (if necessary) by skill
     summary_df = pd.DataFrame(summary, columns=['station_id', 'bias', 'corr', 'rmse', 'nrmse', 'skill'])
-    summary_df["idx"] = list(range(len(summary)))
     #summary_df = summary_df.groupby('station_id').apply(lambda x: x.iloc[x.skill.argmax()])
-    sel_idx = set(summary_df["idx"])
-    summary_df.drop(columns=["idx"]).to_csv(args.output/"summary.csv", index=False)
+    summary_df.to_csv(args.output/"summary.csv", index=False)
 
     if args.tide:
-        model_df = pd.concat([x[0] for x in map(tidal_summary.__getitem__, sel_idx)]).reset_index()
-        obs_df = pd.concat([x[1] for x in map(tidal_summary.__getitem__, sel_idx)]).reset_index()
+        tidal_df = pd.DataFrame.from_records(tidal_rows, columns=['station', 'constituent', 'speed', 'amplitude', 'phase', 'kind'])
+        is_model = tidal_df['kind'] == 'model'
+        model_df = tidal_df.loc[is_model].drop(columns='kind').reset_index(drop=True)
+        obs_df = tidal_df.loc[~is_model].drop(columns='kind').reset_index(drop=True)
 
         amplitude_plot(model_df, obs_df, args.output)
         tidal_error(model_df, obs_df, args.output)
@@ -661,10 +932,13 @@ def get_options():
     parser.add_argument('--output', default=pathlib.Path(), type=pathlib.Path, help="Output directory")
     parser.add_argument('--cut', default=12, type=int, help='Number of hours to remove from head of timeseries')
     parser.add_argument('-t', '--tide', action='store_true', default=False, help='Solve tidal for tidal constituents')
+    parser.add_argument('--fast-tides', action='store_true', help="Estimate tidal constituents by frequency projection instead of least squares")
+    parser.add_argument('--no-cache', action='store_true', help="Do not reuse cached tidal solutions")
     parser.add_argument('-b', '--bias-correct', action='store_true', help="Bias correct all stations")
     parser.add_argument('-s', '--storm', default=['Any'], action='append', help="Storm filter")
     parser.add_argument("--obs", type=pathlib.Path, required=True, help="data folder")
     parser.add_argument("--correspond", type=pathlib.Path, required=True, help='Data correspondence table')
+    parser.add_argument('-j', '--jobs', default=None, type=int, help="Number of stations to process in parallel (default: number of cpus)")
     args = parser.parse_args()
 
     # Determine type based on detected filename patterns